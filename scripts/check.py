@@ -1,23 +1,29 @@
 from anyio import Path as _Path
 from argparse import ArgumentParser as _ArgParser, Namespace as _NS
-from asyncio import (
-    BoundedSemaphore as _BSemp,
-    create_subprocess_exec as _new_sproc,
-    gather as _gather,
-    run as _run,
-)
-from asyncio.subprocess import DEVNULL as _DEVNULL, PIPE as _PIPE
+from asyncio import gather as _gather, run as _run
 from dataclasses import dataclass as _dc
 from functools import wraps as _wraps
-from glob import iglob as _iglob
-from inspect import currentframe as _curframe, getframeinfo as _frameinfo
 from logging import INFO as _INFO, basicConfig as _basicConfig, info as _info
-from os import cpu_count as _cpu_c
-from shutil import which as _which
 from sys import argv as _argv, exit as _exit
 from typing import Callable as _Call, final as _fin
+from util import (
+    JournalRunContext as _JournalRunContext,
+    find_monthly_journals as _find_monthly_journals,
+    gather_and_raise as _gather_and_raise,
+    run_hledger as _run_hledger,
+)
 
-_SUBPROCESS_SEMAPHORE = _BSemp(_cpu_c() or 4)
+_CHECKS = (
+    "accounts",
+    "assertions",
+    "autobalanced",
+    "balanced",
+    "commodities",
+    "ordereddates",
+    "parseable",
+    "payees",
+    "tags",
+)
 
 
 @_fin
@@ -37,61 +43,26 @@ class Arguments:
 
 
 async def main(_: Arguments):
-    frame = _curframe()
-    if frame is None:
-        raise ValueError(frame)
-    folder = _Path(_frameinfo(frame).filename).parent
-
-    journals = await _gather(
-        *(
-            _Path(folder.parent, path).resolve(strict=True)
-            for path in _iglob(
-                "**/*[0123456789][0123456789][0123456789][0123456789]-[0123456789][0123456789]/*.journal",
-                root_dir=folder.parent,
-                recursive=True,
-            )
-        )
+    script = _Path(__file__)
+    folder = script.parent
+
+    journals, hledger_version = await _gather(
+        _find_monthly_journals(folder.parent), _run_hledger("--version")
     )
     _info(f'journals: {", ".join(map(str, journals))}')
 
-    hledger_prog = _which("hledger")
-    if hledger_prog is None:
-        raise FileNotFoundError(hledger_prog)
-
-    async def checkJournal(journal: _Path):
-        async with _SUBPROCESS_SEMAPHORE:
-            proc = await _new_sproc(
-                hledger_prog,
-                "--file",
-                journal,
-                "--strict",
-                "check",
-                "accounts",
-                "assertions",
-                "autobalanced",
-                "balanced",
-                "commodities",
-                "ordereddates",
-                "parseable",
-                "payees",
-                "tags",
-                stdin=_DEVNULL,
-                stdout=_PIPE,
-                stderr=_PIPE,
-            )
-            _stdout, stderr = (
-                std.decode().replace("\r\n", "\n") for std in await proc.communicate()
+    async with _JournalRunContext(
+        script, journals, key="\n".join((hledger_version.strip(), *_CHECKS))
+    ) as run:
+        _info(f'skipped unchanged: {", ".join(map(str, run.skipped))}')
+
+        async def checkJournal(journal: _Path):
+            await _run_hledger(
+                "--file", journal, "--strict", "check", *_CHECKS, capture_stdout=False
             )
-            if await proc.wait():
-                raise ChildProcessError(proc.returncode, stderr)
+            run.report_success(journal)
 
-    errors = tuple(
-        err
-        for err in await _gather(*map(checkJournal, journals), return_exceptions=True)
-        if err
-    )
-    if errors:
-        raise BaseExceptionGroup("", errors)
+        await _gather_and_raise(*map(checkJournal, run.to_process))
 
     _exit(0)
 
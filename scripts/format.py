@@ -1,24 +1,52 @@
 from anyio import Path as _Path
 from argparse import ArgumentParser as _ArgParser, Namespace as _NS
-from asyncio import (
-    BoundedSemaphore as _BSemp,
-    create_subprocess_exec as _new_sproc,
-    create_task,
-    gather as _gather,
-    run as _run,
-)
-from asyncio.subprocess import DEVNULL as _DEVNULL, PIPE as _PIPE
+from asyncio import gather as _gather, run as _run
 from dataclasses import dataclass as _dc
 from functools import wraps as _wraps
-from glob import iglob as _iglob
-from inspect import currentframe as _curframe, getframeinfo as _frameinfo
 from logging import INFO as _INFO, basicConfig as _basicConfig, info as _info
-from os import cpu_count as _cpu_c
-from shutil import which as _which
 from sys import argv as _argv, exit as _exit
-from typing import Callable as _Call, Iterable as _Iter, cast as _cast, final as _fin
+from typing import Callable as _Call, Iterable as _Iter, final as _fin
+from util import (
+    JournalRunContext as _JournalRunContext,
+    find_monthly_journals as _find_monthly_journals,
+    gather_and_raise as _gather_and_raise,
+    journal_update_if_changed as _journal_update_if_changed,
+    run_hledger as _run_hledger,
+)
 
-_SUBPROCESS_SEMAPHORE = _BSemp(_cpu_c() or 4)
+_COMMENT_SEPARATOR = "  ;"
+
+
+def _group_props(sections: _Iter[str]):
+    ret = list[tuple[str, str]]()
+    for section in sections:
+        key, colon, value = section.partition(":")
+        if colon:
+            ret.append((key.strip(), value.strip()))
+            continue
+        if ret:
+            yield ret
+            ret = []
+        yield key
+    if ret:
+        yield ret
+
+
+def _sort_props(line: str):
+    if (index := line.find(_COMMENT_SEPARATOR)) == -1:
+        return line
+    code, cmt = line[:index], line[index + len(_COMMENT_SEPARATOR) :]
+    if ":" not in cmt:
+        return f"""{code}  {f'''; {", ".join(
+            section.strip() for section in cmt.split(",")
+        )}'''.strip()}"""
+
+    return f"""{code}  {f'''; {", ".join(
+        group.strip()
+        if isinstance(group, str)
+        else ", ".join(f"{key}: {value}" for key, value in sorted(group))
+        for group in _group_props(cmt.split(","))
+    )}'''.strip()}"""
 
 
 @_fin
@@ -38,109 +66,35 @@ class Arguments:
 
 
 async def main(_: Arguments):
-    frame = _curframe()
-    if frame is None:
-        raise ValueError(frame)
-    folder = _Path(_frameinfo(frame).filename).parent
-
-    journals = await _gather(
-        *(
-            _Path(folder.parent, path).resolve(strict=True)
-            for path in _iglob(
-                "**/*[0123456789][0123456789][0123456789][0123456789]-[0123456789][0123456789]/*.journal",
-                root_dir=folder.parent,
-                recursive=True,
-            )
-        )
+    script = _Path(__file__)
+    folder = script.parent
+
+    journals, hledger_version = await _gather(
+        _find_monthly_journals(folder.parent), _run_hledger("--version")
     )
     _info(f'journals: {", ".join(map(str, journals))}')
 
-    hledger_prog = _which("hledger")
-    if hledger_prog is None:
-        raise FileNotFoundError(hledger_prog)
-
-    async def formatJournal(journal: _Path):
-        async with _SUBPROCESS_SEMAPHORE:
-            proc = await _new_sproc(
-                hledger_prog,
-                "--file",
-                journal,
-                "--strict",
-                "print",
-                stdin=_DEVNULL,
-                stdout=_PIPE,
-                stderr=_PIPE,
-            )
-            stdout, stderr = (
-                std.decode().replace("\r\n", "\n") for std in await proc.communicate()
-            )
-            if await proc.wait():
-                raise ChildProcessError(proc.returncode, stderr)
-
-        async with await journal.open(
-            mode="r+t", encoding="UTF-8", errors="strict", newline=None
-        ) as file:
-            read = await file.read()
-            seek = create_task(file.seek(0))
-            try:
-                header = "\n".join(
+    # a formatted journal is a fixed point, so an unchanged one needs no `print`
+    async with _JournalRunContext(script, journals, key=hledger_version.strip()) as run:
+        _info(f'skipped unchanged: {", ".join(map(str, run.skipped))}')
+
+        async def formatJournal(journal: _Path):
+            stdout = await _run_hledger("--file", journal, "--strict", "print")
+            body = stdout.strip().splitlines() or [""]
+
+            def updater(read: str):
+                header = [
                     line for line in read.splitlines() if line.startswith("include ")
+                ] or [""]
+                return "\n".join(
+                    _sort_props(line) if _COMMENT_SEPARATOR in line else line
+                    for line in (*header, "", *body, "")
                 )
-                text = f"""{header}
-
-{stdout.strip()}
-
-"""
-
-                def sortProps(line: str):
-                    components = line.split("  ;", 1)
-                    if len(components) != 2:
-                        return line
-                    code, cmt = components
-
-                    def group(sections: _Iter[str]):
-                        ret = list[tuple[str, str]]()
-                        for section in sections:
-                            section = _cast(
-                                tuple[str] | tuple[str, str],
-                                tuple(section.split(":", 1)),
-                            )
-                            if len(section) == 2:
-                                ret.append(section)
-                                continue
-                            if ret:
-                                yield ret
-                                ret = []
-                            yield section[0]
-                        if ret:
-                            yield ret
-
-                    return f"""{code}  {f'''; {", ".join(
-                        group.strip()
-                        if isinstance(group, str)
-                        else ", ".join(
-                            ": ".join(prop)
-                            for prop in sorted(
-                                tuple(cmp.strip() for cmp in group) for group in group
-                            )
-                        )
-                        for group in group(cmt.split(","))
-                    )}'''.strip()}"""
-
-                if (text := "\n".join(map(sortProps, text.splitlines()))) != read:
-                    await seek
-                    await file.write(text)
-                    await file.truncate()
-            finally:
-                seek.cancel()
-
-    errors = tuple(
-        err
-        for err in await _gather(*map(formatJournal, journals), return_exceptions=True)
-        if err
-    )
-    if errors:
-        raise BaseExceptionGroup("", errors)
+
+            _, state = await _journal_update_if_changed(journal, updater)
+            run.report_success(journal, state)
+
+        await _gather_and_raise(*map(formatJournal, run.to_process))
 
     _exit(0)
 
@@ -1,13 +1,16 @@
 from anyio import Path as _Path
 from argparse import ArgumentParser as _ArgParser, Namespace as _NS
-from asyncio import create_task, gather as _gather, run as _run
+from asyncio import run as _run
 from dataclasses import dataclass as _dc
 from functools import wraps as _wraps
-from glob import iglob as _iglob
-from inspect import currentframe as _curframe, getframeinfo as _frameinfo
 from logging import INFO as _INFO, basicConfig as _basicConfig, info as _info
 from sys import argv as _argv, exit as _exit
 from typing import Callable as _Call, final as _fin
+from util import (
+    file_update_if_changed as _file_update_if_changed,
+    find_journals as _find_journals,
+    gather_and_raise as _gather_and_raise,
+)
 
 
 @_fin
@@ -28,46 +31,19 @@ class Arguments:
 
 
 async def main(args: Arguments):
-    frame = _curframe()
-    if frame is None:
-        raise ValueError(frame)
-    folder = _Path(_frameinfo(frame).filename).parent
+    folder = _Path(__file__).parent
 
-    journals = await _gather(
-        *(
-            _Path(folder.parent, path).resolve(strict=True)
-            for path in _iglob(
-                "**/*.journal",
-                root_dir=folder.parent,
-                recursive=True,
-            )
-        )
-    )
+    journals = await _find_journals(folder.parent)
     _info(f'journals: {", ".join(map(str, journals))}')
 
     async def replaceInJournal(journal: _Path):
-        async with await journal.open(
-            mode="r+t", encoding="UTF-8", errors="strict", newline=None
-        ) as file:
-            read = await file.read()
-            seek = create_task(file.seek(0))
-            try:
-                if (text := read.replace(args.find, args.replace)) != read:
-                    await seek
-                    await file.write(text)
-                    await file.truncate()
-            finally:
-                seek.cancel()
-
-    formatErrs = tuple(
-        err
-        for err in await _gather(
-            *map(replaceInJournal, journals), return_exceptions=True
+        await _file_update_if_changed(
+            journal,
+            lambda read: read.replace(args.find, args.replace),
+            needle=args.find,
         )
-        if err
-    )
-    if formatErrs:
-        raise BaseExceptionGroup("", formatErrs)
+
+    await _gather_and_raise(*map(replaceInJournal, journals))
 
     _exit(0)
 
@@ -1,20 +1,28 @@
 from contextlib import suppress
-from datetime import datetime
+from datetime import MAXYEAR, MINYEAR, datetime
 from anyio import Path as _Path
 from argparse import ArgumentParser as _ArgParser, Namespace as _NS
-from asyncio import create_task, gather as _gather, run as _run
+from asyncio import run as _run
+from calendar import monthrange as _monthrange
 from dataclasses import dataclass as _dc
-from functools import wraps as _wraps
-from glob import iglob as _iglob
-from inspect import currentframe as _curframe, getframeinfo as _frameinfo
+from functools import cache as _cache, wraps as _wraps
 from logging import INFO as _INFO, basicConfig as _basicConfig, info as _info
-from re import MULTILINE, NOFLAG, compile, escape
+from re import ASCII, MULTILINE, NOFLAG, compile, escape
 from sys import argv as _argv, exit as _exit
 from typing import Callable as _Call, final as _fin
+from util import (
+    file_update_if_changed as _file_update_if_changed,
+    find_monthly_journals as _find_monthly_journals,
+    gather_and_raise as _gather_and_raise,
+)
 
-_OPENING_BALANCES_REGEX = compile(r"opening balances", NOFLAG)
-_CLOSING_BALANCES_REGEX = compile(r"closing balances", NOFLAG)
+_OPENING_BALANCES = "opening balances"
+_CLOSING_BALANCES = "closing balances"
+_DATED_LINE_PATTERN = r"(?P<dated>^[0123456789][^\n]*)"
+_YEAR_MONTH_REGEX = compile(r"([0123456789]{4})(?:-([0123456789]{2}))?", NOFLAG)
+_DIGIT_SEPARATORS_TABLE = str.maketrans("", "", " ,")
 _NUMBER_OF_DIGITS = 2
+_AMOUNT_FORMAT_SPEC = f".{_NUMBER_OF_DIGITS}f"
 
 
 @_fin
@@ -38,10 +46,7 @@ class Arguments:
 
 
 async def main(args: Arguments):
-    frame = _curframe()
-    if frame is None:
-        raise ValueError(frame)
-    folder = _Path(_frameinfo(frame).filename).parent
+    folder = _Path(__file__).parent
 
     if (from_datetime := args.from_datetime) is None:
 
@@ -66,74 +71,73 @@ async def main(args: Arguments):
     def filter_datetime(datetime_: datetime):
         return from_filter(datetime_) and to_filter(datetime_)
 
-    journals = await _gather(
-        *(
-            _Path(folder.parent, path).resolve(strict=True)
-            for path in _iglob(
-                "**/*[0123456789][0123456789][0123456789][0123456789]-[0123456789][0123456789]/*.journal",
-                root_dir=folder.parent,
-                recursive=True,
-            )
-        )
-    )
+    # a monthly journal is selected by the first moment of its month, so
+    # compare (year, month) pairs against the first and last selected months
+    from_month, to_month = (MINYEAR, 1), (MAXYEAR, 12)
+    if from_datetime is not None:
+        year, month = from_month = from_datetime.year, from_datetime.month
+        if from_datetime > datetime(year, month, 1):
+            from_month = year + month // 12, month % 12 + 1
+    if to_datetime is not None:
+        to_month = to_datetime.year, to_datetime.month
+
     journals = tuple(
         journal
-        for journal in journals
-        if filter_datetime(datetime.fromisoformat(f"{journal.parent.name}-01"))
+        for journal in await _find_monthly_journals(folder.parent)
+        if from_month
+        <= (int(journal.parent.name[-7:-3]), int(journal.parent.name[-2:]))
+        <= to_month
     )
     _info(f'journals: {", ".join(map(str, journals))}')
 
-    async def process_journal(journal: _Path):
-        async with await journal.open(
-            mode="r+t", encoding="UTF-8", errors="strict", newline=None
-        ) as file:
-            read = await file.read()
-            seek = create_task(file.seek(0))
-            try:
-
-                def process_lines(read: str):
-                    def parse_float(float_str: str):
-                        return float(float_str.replace(" ", "").replace(",", ""))
-
-                    regex = compile(
-                        rf"^( +){escape(args.account)}( +)(-?[\d ,]+(?:\.[\d ,]*)?)( +){escape(args.currency)}( *)=( *)(-?[\d ,]+(?:\.[\d ,]*)?)( +){escape(args.currency)}( *)$",
-                        MULTILINE,
+    regex = compile(
+        rf"^( +){escape(args.account)}( +)(-?[\d ,]+(?:\.[\d ,]*)?)( +){escape(args.currency)}( *)=( *)(-?[\d ,]+(?:\.[\d ,]*)?)( +){escape(args.currency)}( *)$",
+        MULTILINE | ASCII,
+    )
+    scanner = compile(rf"{regex.pattern}|{_DATED_LINE_PATTERN}", regex.flags)
+
+    parse_datetime = _cache(datetime.fromisoformat)
+
+    def parse_float(float_str: str):
+        return float(float_str.translate(_DIGIT_SEPARATORS_TABLE))
+
+    def process_journal(read: str):
+        if regex.search(read) is None:
+            return read
+
+        datetime_, opening, closing = None, False, False
+        parts, end = list[str](), 0
+        for match in scanner.finditer(read):
+            if (line := match["dated"]) is not None:
+                start = match.start()
+                try:
+                    # same as `line[:10]` with the line ending kept
+                    datetime_ = parse_datetime(
+                        read[start : min(start + 10, match.end() + 1)]
                     )
-                    datetime_, opening, closing = None, False, False
-                    for line in read.splitlines(keepends=True):
-                        try:
-                            datetime_ = datetime.fromisoformat(line[:10])
-                        except ValueError:
-                            pass
-                        else:
-                            opening, closing = bool(
-                                _OPENING_BALANCES_REGEX.search(line)
-                            ), bool(_CLOSING_BALANCES_REGEX.search(line))
-                        if (
-                            datetime_ is None
-                            or not filter_datetime(datetime_)
-                            or not (match := regex.match(line))
-                        ):
-                            yield line
-                            continue
-                        yield f"{match[1]}{args.account}{match[2]}{f'{{0:.{_NUMBER_OF_DIGITS}f}}'.format(round(parse_float(match[3]) + args.amount * (opening - closing), _NUMBER_OF_DIGITS))}{match[4]}{args.currency}{match[5]}={match[6]}{f'{{0:.{_NUMBER_OF_DIGITS}f}}'.format(round(parse_float(match[7]) + args.amount * (not closing), _NUMBER_OF_DIGITS))}{match[8]}{args.currency}{match[9]}\n"
-
-                if (text := "".join(process_lines(read))) != read:
-                    await seek
-                    await file.write(text)
-                    await file.truncate()
-            finally:
-                seek.cancel()
-
-    formatErrs = tuple(
-        err
-        for err in await _gather(
-            *map(process_journal, journals), return_exceptions=True
+                except ValueError:
+                    continue
+                opening, closing = _OPENING_BALANCES in line, _CLOSING_BALANCES in line
+                continue
+            if datetime_ is None or not filter_datetime(datetime_):
+                continue
+            parts.append(read[end : match.start()])
+            parts.append(
+                f"{match[1]}{args.account}{match[2]}{round(parse_float(match[3]) + args.amount * (opening - closing), _NUMBER_OF_DIGITS):{_AMOUNT_FORMAT_SPEC}}{match[4]}{args.currency}{match[5]}={match[6]}{round(parse_float(match[7]) + args.amount * (not closing), _NUMBER_OF_DIGITS):{_AMOUNT_FORMAT_SPEC}}{match[8]}{args.currency}{match[9]}\n"
+            )
+            # the rewritten line brings its own line ending
+            end = match.end() + 1
+        if not parts:
+            return read
+        parts.append(read[end:])
+        return "".join(parts)
+
+    await _gather_and_raise(
+        *(
+            _file_update_if_changed(journal, process_journal, needle=args.account)
+            for journal in journals
         )
-        if err
     )
-    if formatErrs:
-        raise BaseExceptionGroup("", formatErrs)
 
     _exit(0)
 
@@ -155,12 +159,10 @@ def parser(parent: _Call[..., _ArgParser] | None = None):
         try:
             return datetime.fromisoformat(date_string)
         except ValueError:
-            for day in range(31, 27, -1):
-                with suppress(ValueError):
-                    return datetime.fromisoformat(f"{date_string}-{day}")
-            for day in range(31, 27, -1):
+            if match := _YEAR_MONTH_REGEX.fullmatch(date_string):
+                year, month = int(match[1]), int(match[2] or 12)
                 with suppress(ValueError):
-                    return datetime.fromisoformat(f"{date_string}-12-{day}")
+                    return datetime(year, month, _monthrange(year, month)[1])
             raise
 
     parser = (_ArgParser if parent is None else parent)(
@@ -0,0 +1,397 @@
+from anyio import Path as _Path, to_thread as _to_thread
+from asyncio import (
+    BoundedSemaphore as _BSemp,
+    create_subprocess_exec as _new_sproc,
+    gather as _gather,
+)
+from asyncio.subprocess import DEVNULL as _DEVNULL, PIPE as _PIPE
+from collections import deque as _deque
+from functools import cache as _cache
+from hashlib import blake2b as _blake2b, file_digest as _file_digest
+from json import dumps as _dumps, loads as _loads
+from os import (
+    PathLike as _PathLike,
+    cpu_count as _cpu_c,
+    fspath as _fspath,
+    fstat as _fstat,
+    makedirs as _makedirs,
+    replace as _replace,
+    linesep as _linesep,
+    scandir as _scandir,
+    stat as _stat,
+    stat_result as _StatResult,
+)
+from os.path import (
+    dirname as _dirname,
+    join as _join,
+    normpath as _normpath,
+    splitext as _splitext,
+)
+from re import NOFLAG as _NOFLAG, compile as _re_comp
+from shutil import which as _which
+from typing import (
+    Any as _Any,
+    Awaitable as _Await,
+    BinaryIO as _BinaryIO,
+    Callable as _Call,
+    Iterable as _Iterable,
+    Iterator as _Iter,
+    Self as _Self,
+    TypeVar as _TVar,
+    cast as _cast,
+    final as _fin,
+)
+
+_T = _TVar("_T")
+
+_CACHE_FOLDER_NAME = ".cache"
+_HASH_ALGORITHM = "blake2b-256"
+_INCLUDE_DIRECTIVE = b"include "
+_SUBPROCESS_SEMAPHORE = _BSemp(_cpu_c() or 4)
+
+_MONTHLY_FOLDER_REGEX = _re_comp(r".*[0123456789]{4}-[0123456789]{2}", _NOFLAG)
+
+
+def _walk_journals(
+    root: str | _PathLike[str], folder_filter: _Call[[str], object] | None
+) -> _Iter[str]:
+    # like the `**/` globs, the root folder itself only matches without a filter
+    folders = _deque[tuple[str | _PathLike[str], object]](
+        ((root, folder_filter is None),)
+    )
+    while folders:
+        folder, selected = folders.popleft()
+        try:
+            with _scandir(folder) as entries:
+                for entry in entries:
+                    # skip hidden entries like `glob` does
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(
+                            (
+                                entry.path,
+                                folder_filter is None or folder_filter(entry.name),
+                            )
+                        )
+                    elif (
+                        selected
+                        and entry.name.endswith(".journal")
+                        and entry.is_file(follow_symlinks=False)
+                    ):
+                        yield entry.path
+        except OSError:
+            # like `glob`, skip folders that cannot be read
+            continue
+
+
+def walk_journals(root: str | _PathLike[str]) -> _Iter[str]:
+    return _walk_journals(root, None)
+
+
+def walk_monthly_journals(root: str | _PathLike[str]) -> _Iter[str]:
+    return _walk_journals(root, _MONTHLY_FOLDER_REGEX.fullmatch)
+
+
+async def find_journals(root: str | _PathLike[str]):
+    return await _to_thread.run_sync(lambda: tuple(map(_Path, walk_journals(root))))
+
+
+async def find_monthly_journals(root: str | _PathLike[str]):
+    return await _to_thread.run_sync(
+        lambda: tuple(map(_Path, walk_monthly_journals(root)))
+    )
+
+
+@_cache
+def hledger_program():
+    if (prog := _which("hledger")) is None:
+        raise FileNotFoundError("hledger")
+    return prog
+
+
+async def run_hledger(*args: str | _PathLike[str], capture_stdout: bool = True):
+    async with _SUBPROCESS_SEMAPHORE:
+        proc = await _new_sproc(
+            hledger_program(),
+            *args,
+            stdin=_DEVNULL,
+            stdout=_PIPE if capture_stdout else _DEVNULL,
+            stderr=_PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+    if proc.returncode:
+        raise ChildProcessError(proc.returncode, stderr.decode().replace("\r\n", "\n"))
+    return "" if stdout is None else stdout.decode().replace("\r\n", "\n")
+
+
+async def gather_and_raise(*aws: _Await[_T]) -> tuple[_T, ...]:
+    # unlike a task group, a failure does not cancel the other awaitables
+    results = await _gather(*aws, return_exceptions=True)
+    errors = tuple(ret for ret in results if isinstance(ret, BaseException))
+    if errors:
+        raise BaseExceptionGroup("", errors)
+    return _cast(tuple[_T, ...], tuple(results))
+
+
+def _update_if_changed(
+    file: _BinaryIO, updater: _Call[[str], str], needle: str | None
+) -> tuple[bytes, bool]:
+    data = file.read()
+    # newlines are translated below, so only search for needles without any
+    if (
+        needle is not None
+        and not ("\r" in needle or "\n" in needle)
+        and needle.encode("UTF-8", "strict") not in data
+    ):
+        return data, False
+    # same as reading in text mode with universal newlines
+    read = data.decode("UTF-8", "strict").replace("\r\n", "\n").replace("\r", "\n")
+    if (text := updater(read)) == read:
+        return data, False
+    data = text.replace("\n", _linesep).encode("UTF-8", "strict")
+    file.seek(0)
+    file.write(data)
+    file.truncate()
+    return data, True
+
+
+def _file_update_if_changed(
+    path: str | _PathLike[str], updater: _Call[[str], str], needle: str | None
+):
+    with open(path, mode="r+b") as file:
+        return _update_if_changed(file, updater, needle)[1]
+
+
+async def file_update_if_changed(
+    path: str | _PathLike[str],
+    updater: _Call[[str], str],
+    *,
+    needle: str | None = None,
+):
+    return await _to_thread.run_sync(_file_update_if_changed, path, updater, needle)
+
+
+def _journal_update_if_changed(
+    journal: str | _PathLike[str], updater: _Call[[str], str]
+):
+    with open(journal, mode="r+b") as file:
+        data, changed = _update_if_changed(file, updater, None)
+        # the state of what was written, whatever happens to the file afterwards
+        return changed, _journal_hash(journal, (_fstat(file.fileno()), data))
+
+
+async def journal_update_if_changed(
+    journal: str | _PathLike[str], updater: _Call[[str], str]
+):
+    return await _to_thread.run_sync(_journal_update_if_changed, journal, updater)
+
+
+def _new_hash(data: bytes = b""):
+    return _blake2b(data, digest_size=32)
+
+
+def _file_hash(path: str | _PathLike[str]):
+    with open(path, mode="rb") as file:
+        return _file_digest(file, _new_hash).digest()
+
+
+def _journal_hash(
+    journal: str | _PathLike[str], read: tuple[_StatResult, bytes] | None = None
+) -> dict[str, _Any] | None:
+    root = _fspath(journal)
+    hasher, pending = _new_hash(), [root]
+    files = dict[str, tuple[int, int]]()
+    while pending:
+        if (path := pending.pop()) in files:
+            continue
+        try:
+            if path == root and read is not None:
+                stat, data = read
+            else:
+                with open(path, mode="rb") as file:
+                    stat, data = _fstat(file.fileno()), file.read()
+            includes = tuple(
+                line[len(_INCLUDE_DIRECTIVE) :].strip().decode()
+                for line in data.splitlines()
+                if line.startswith(_INCLUDE_DIRECTIVE)
+            )
+        except (OSError, UnicodeDecodeError):
+            # e.g. a glob or folder `include`, which is not tracked
+            return None
+        files[path] = stat.st_size, stat.st_mtime_ns
+        hasher.update(_new_hash(data).digest())
+        pending.extend(
+            _normpath(_join(_dirname(path), include)) for include in includes
+        )
+    return {"files": files, "hash": hasher.hexdigest()}
+
+
+def _files_unchanged(files: _Any, exclude: str | None = None):
+    # same sizes and modification times are taken as same contents
+    return all(
+        path == exclude
+        or ((stat := _stat(path)).st_size, stat.st_mtime_ns) == (size, mtime_ns)
+        for path, (size, mtime_ns) in files.items()
+    )
+
+
+def _journal_unchanged(journal: str | _PathLike[str], known: _Any):
+    try:
+        return (
+            isinstance(known["hash"], str)
+            and isinstance(files := known["files"], dict)
+            and _fspath(journal) in files
+            and _files_unchanged(files)
+        )
+    except (LookupError, OSError, TypeError, ValueError):
+        return False
+
+
+def _journal_state(journal: str | _PathLike[str], known: _Any):
+    if _journal_unchanged(journal, known):
+        return _cast(dict[str, _Any], known)
+    return _journal_hash(journal)
+
+
+def _seen_state(journal: str | _PathLike[str], entered: _Any, written: _Any):
+    # only the contents seen by the run are known to be good, so any later
+    # change leaves the journal to the next run
+    if written is None:
+        return entered if _journal_unchanged(journal, entered) else None
+    try:
+        if _journal_unchanged(journal, written) and _files_unchanged(
+            entered["files"], _fspath(journal)
+        ):
+            return _cast(dict[str, _Any], written)
+    except (LookupError, OSError, TypeError, ValueError):
+        pass
+    return None
+
+
+async def _journal_states(journals: _Iterable[_Path], known: dict[str, _Any]):
+    return await _gather(
+        *(
+            _to_thread.run_sync(_journal_state, journal, known.get(str(journal)))
+            for journal in journals
+        )
+    )
+
+
+def _read_cache(path: str | _PathLike[str]) -> _Any:
+    try:
+        with open(path, mode="rt", encoding="UTF-8", errors="strict") as file:
+            return _loads(file.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_cache(path: str | _PathLike[str], cache: _Any):
+    _makedirs(_dirname(path), exist_ok=True)
+    temp_path = f"{_splitext(path)[0]}.tmp"
+    with open(temp_path, mode="wt", encoding="UTF-8", errors="strict") as file:
+        file.write(_dumps(cache, indent=2, sort_keys=True))
+    _replace(temp_path, path)
+
+
+@_fin
+class JournalRunContext:
+    __slots__ = (
+        "_cache_file",
+        "_cached",
+        "_journals",
+        "_key",
+        "_reported",
+        "_script",
+        "_script_key",
+        "_states",
+        "skipped",
+        "to_process",
+    )
+
+    def __init__(
+        self,
+        script: str | _PathLike[str],
+        journals: _Iterable[_Path],
+        *,
+        key: str = "",
+    ):
+        self._script = _Path(script)
+        self._journals = tuple(journals)
+        self._key = key
+        self._script_key = ""
+        self._cache_file = _Path(
+            self._script.parent.parent,
+            _CACHE_FOLDER_NAME,
+            f"{self._script.stem}.json",
+        )
+        self._cached = dict[str, _Any]()
+        self._states = dict[str, _Any]()
+        self._reported = list[tuple[_Path, _Any]]()
+        self.skipped = tuple[_Path, ...]()
+        self.to_process = self._journals
+
+    async def __aenter__(self) -> _Self:
+        # changing the script, this module or the key invalidates the cache
+        script_hash, util_hash = await _gather(
+            _to_thread.run_sync(_file_hash, self._script),
+            _to_thread.run_sync(_file_hash, __file__),
+        )
+        self._script_key = _new_hash(
+            script_hash + util_hash + b"\0" + self._key.encode()
+        ).hexdigest()
+        cache = await _to_thread.run_sync(_read_cache, self._cache_file)
+        if (
+            isinstance(cache, dict)
+            and cache.get("algorithm") == _HASH_ALGORITHM
+            and cache.get("key") == self._script_key
+        ):
+            self._cached = dict(cache.get("journals", {}))
+
+        states = await _journal_states(self._journals, self._cached)
+        skipped, to_process = list[_Path](), list[_Path]()
+        for journal, state in zip(self._journals, states):
+            self._states[str(journal)] = state
+            cached = self._cached.get(str(journal))
+            if (
+                state is not None
+                and isinstance(cached, dict)
+                and cached.get("hash") == state["hash"]
+            ):
+                self._cached[str(journal)] = state
+                skipped.append(journal)
+            else:
+                to_process.append(journal)
+        self.skipped, self.to_process = tuple(skipped), tuple(to_process)
+        return self
+
+    def report_success(self, journal: _Path, state: _Any = None):
+        self._reported.append((journal, state))
+
+    async def __aexit__(self, *_: object):
+        states = await _gather(
+            *(
+                _to_thread.run_sync(
+                    _seen_state, journal, self._states.get(str(journal)), state
+                )
+                for journal, state in self._reported
+            )
+        )
+        for (journal, _), state in zip(self._reported, states):
+            if state is None:
+                self._cached.pop(str(journal), None)
+            else:
+                self._cached[str(journal)] = state
+
+        journals = set(map(str, self._journals))
+        await _to_thread.run_sync(
+            _write_cache,
+            self._cache_file,
+            {
+                "algorithm": _HASH_ALGORITHM,
+                "key": self._script_key,
+                "journals": {
+                    key: value for key, value in self._cached.items() if key in journals
+                },
+            },
+        )